@@ -0,0 +1,91 @@
+"""
+Batch plumbing shared by the pre-processor scripts: input listing, output
+cleanup, the template cache (keys and .npz entries) and the per-file process pool.
+"""
+
+from __future__ import annotations
+import hashlib, os, zipfile
+import multiprocessing as mp
+from pathlib import Path
+import numpy as np
+import cv2
+
+# ---------- input / output folders ----------
+def list_images(folder: Path, exts: tuple[str,...]) -> list[Path]:
+    """One os.scandir pass: DirEntry.is_file() reuses the readdir type, so no per-file stat."""
+    allowed = frozenset(exts)
+    with os.scandir(folder) as it:
+        names = [e.name for e in it if os.path.splitext(e.name)[1].lower() in allowed and e.is_file()]
+    return [folder / n for n in sorted(names)]
+
+def is_page_sibling(name: str, stems) -> bool:
+    """True if `name` matches the glob `{stem}_*.*` for some page stem in `stems`."""
+    i = name.find("_")
+    while i > 0:
+        if name[:i] in stems and "." in name[i+1:]: return True
+        i = name.find("_", i+1)
+    return False
+
+def clean_outputs(out_dir: Path, stems, keep_debug=False):
+    """One directory scan after the batch: keep each page's {stem}_final.jpg (and
+    *_debug.jpg if asked); drop its other {stem}_*.* siblings and any other non-final .jpg."""
+    stems = set(stems)
+    final_names = {f"{s}_final.jpg" for s in stems}
+    with os.scandir(out_dir) as it:
+        for e in it:
+            n = e.name
+            if n in final_names or not e.is_file(): continue
+            if keep_debug and n.endswith("_debug.jpg"): continue
+            if is_page_sibling(n, stems) or (n.lower().endswith(".jpg") and not n.endswith("_final.jpg")):
+                try: os.unlink(e.path)
+                except Exception: pass
+
+# ---------- template cache ----------
+def templ_fingerprint(path: str) -> str:
+    """Cache key from the template's resolved path, size and mtime: O(1), no file read.
+    Re-saving or replacing the template changes its mtime and so invalidates the cache."""
+    p = Path(path).resolve(); st = p.stat()
+    key = f"{p}|{st.st_size}|{st.st_mtime_ns}".encode("utf-8", "surrogateescape")
+    return hashlib.blake2b(key, digest_size=8).hexdigest()
+
+def load_npz(path: Path, keys):
+    """Cached arrays {key: array} from a .npz, or None if it is missing, lacks one of
+    `keys`, or is unreadable. A bad entry (e.g. truncated) is deleted so it gets rebuilt."""
+    if not path.exists(): return None
+    try:
+        with np.load(path) as z:
+            return {k: z[k] for k in keys}
+    except (OSError, ValueError, KeyError, EOFError, zipfile.BadZipFile):
+        try: path.unlink()
+        except OSError: pass
+        return None
+
+def save_npz(path: Path, **arrays):
+    """np.savez into a temp file beside `path`, then os.replace: an interrupted run
+    never leaves a partial cache entry behind."""
+    tmp = path.with_name(f".{path.name}.{os.getpid()}.tmp")
+    try:
+        with open(tmp, "wb") as f: np.savez(f, **arrays)
+        os.replace(tmp, path)
+    finally:
+        try: tmp.unlink()
+        except OSError: pass
+
+# ---------- process pool ----------
+def init_cv_worker(opencl=None):
+    """Pool-initializer step: parallelism is per file, so keep OpenCV single-threaded.
+    `opencl` (if not None) sets the T-API switch, which is per process."""
+    cv2.setNumThreads(1)
+    if opencl is not None:
+        cv2.ocl.setUseOpenCL(bool(opencl))
+
+def imap_pool(fn, jobs, workers, initializer, initargs):
+    """Yield fn(job) for every job from `workers` processes, in completion order.
+
+    Batch-invariant state goes through `initializer(*initargs)` (scripts keep it in
+    module globals), so it is shipped once per worker instead of with every task.
+    Windows only supports spawn; it is asked for explicitly there."""
+    ctx = mp.get_context("spawn") if os.name == "nt" else mp.get_context()
+    chunk = max(1, min(4, len(jobs) // (4*workers)))
+    with ctx.Pool(workers, initializer=initializer, initargs=initargs) as pool:
+        yield from pool.imap_unordered(fn, jobs, chunksize=chunk)
@@ -0,0 +1,48 @@
+"""
+Drawing helpers shared by the pre-processor scripts.
+"""
+
+from __future__ import annotations
+from functools import lru_cache
+import numpy as np
+import cv2
+
+@lru_cache(maxsize=8)
+def _bullseye_sprite(radius):
+    """Render one bullseye once per radius -> (premultiplied sprite*alpha, 255-alpha, center offset),
+    both uint16 and 3-channel so a corner stamp is two saturating cv2 ops.
+
+    The inner rings sit inside the fully covered part of the outer disk, so
+    blending img*(1-a) + sprite*a reproduces drawing the circles onto img."""
+    c = radius + 2
+    n = 2 * c + 1
+    sprite = np.zeros((n, n, 3), np.uint8)
+    alpha = np.zeros((n, n), np.uint8)
+    cv2.circle(alpha, (c, c), max(1, int(radius)), 255, -1, lineType=cv2.LINE_AA)
+    for col, r in [((255, 255, 255), int(radius * 0.55)),
+                   ((0, 0, 0), int(radius * 0.25))]:
+        cv2.circle(sprite, (c, c), max(1, int(r)), col, -1, lineType=cv2.LINE_AA)
+    cv2.circle(sprite, (c, c), max(1, radius // 10), (255, 255, 255), -1, lineType=cv2.LINE_AA)
+    a = alpha.astype(np.uint16)[:, :, None]
+    return sprite * a, np.repeat(255 - a, 3, axis=2), c
+
+def add_bullseyes(img, margin=22, radius=16):
+    """Stamps black/white/black concentric circles in all 4 corners."""
+    H, W = img.shape[:2]
+    SA, IA, c = _bullseye_sprite(radius)
+    corners = [(margin, margin), (W - margin, margin),
+               (margin, H - margin), (W - margin, H - margin)]
+    for (x, y) in corners:
+        x0, y0 = int(x) - c, int(y) - c
+        # clip the sprite to the image
+        sx0, sy0 = max(0, -x0), max(0, -y0)
+        sx1, sy1 = min(SA.shape[1], W - x0), min(SA.shape[0], H - y0)
+        if sx1 <= sx0 or sy1 <= sy0:
+            continue
+        roi = img[y0 + sy0:y0 + sy1, x0 + sx0:x0 + sx1]
+        sa, ia = SA[sy0:sy1, sx0:sx1], IA[sy0:sy1, sx0:sx1]
+        if roi.ndim == 2:
+            sa, ia = np.ascontiguousarray(sa[..., 0]), np.ascontiguousarray(ia[..., 0])
+        # (roi*(255-a) + sprite*a) / 255, rounded: the sum never exceeds 255*255
+        t = cv2.add(cv2.multiply(roi, ia, dtype=cv2.CV_16U), sa)
+        roi[...] = cv2.convertScaleAbs(t, alpha=1 / 255.).reshape(roi.shape)
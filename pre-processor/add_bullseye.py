@@ -8,9 +8,13 @@ Usage:
 """
 
 from __future__ import annotations
-import argparse, sys
+import argparse, os, sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 import cv2
+from _drawing import add_bullseyes
+from _batch import list_images, init_cv_worker, imap_pool
 
 # ---------- colored logs ----------
 try:
@@ -26,22 +30,64 @@ def log_ok(m):   print(C.OK+m+C.END)
 def log_info(m): print(C.INFO+m+C.END)
 def log_warn(m): print(C.WARN+m+C.END)
 def log_err(m):  print(C.ERR+m+C.END)
-
-# ---------- helpers ----------
-def list_images(folder: Path, exts: tuple[str,...]) -> list[Path]:
-    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in exts])
-
-def add_bullseyes(img, margin=22, radius=16):
-    """Draws black/white/black concentric circles in all 4 corners."""
-    H, W = img.shape[:2]
-    corners = [(margin, margin), (W - margin, margin),
-               (margin, H - margin), (W - margin, H - margin)]
-    for (x, y) in corners:
-        for col, r in [((0, 0, 0), radius),
-                       ((255, 255, 255), int(radius * 0.55)),
-                       ((0, 0, 0), int(radius * 0.25))]:
-            cv2.circle(img, (int(x), int(y)), max(1, int(r)), col, -1, lineType=cv2.LINE_AA)
-        cv2.circle(img, (int(x), int(y)), max(1, radius // 10), (255, 255, 255), -1, lineType=cv2.LINE_AA)
+LOG = {"ok": log_ok, "info": log_info, "warn": log_warn, "err": log_err}
+
+# ---------- per-file worker ----------
+# options, set once per worker process (see _batch.imap_pool)
+_args = _out_dir = None
+
+def _set_state(args, out_dir):
+    global _args, _out_dir
+    _args, _out_dir = args, out_dir
+
+def _init_worker(args, out_dir):
+    _set_state(args, out_dir)
+    init_cv_worker()
+
+def _read(p):
+    return cv2.imread(str(p), cv2.IMREAD_COLOR)
+
+def _stamp_and_save(i, total, p, img):
+    """Stamp and write one decoded image; returns (level, message)."""
+    prefix = f"[file {i}/{total}]"
+    if img is None:
+        return "warn", f"{prefix} skip: cannot read {p.name}"
+
+    # Add bullseyes in-place
+    add_bullseyes(img, margin=_args.bull_margin, radius=_args.bull_radius)
+
+    # Save
+    out_path = _out_dir / f"{p.stem}{_args.suffix}{p.suffix}"
+    ok = cv2.imwrite(str(out_path), img)
+    if not ok:
+        return "warn", f"{prefix} failed to write {out_path.name}"
+    return "ok", f"{prefix} {p.name} → {out_path.name}"
+
+def _process_one(job):
+    """Pool task: read, stamp and write one image."""
+    i, total, p = job
+    return _stamp_and_save(i, total, p, _read(p))
+
+def _run_pipelined(jobs, depth=4):
+    """In-process path: decode ahead on one helper thread and stamp+encode on
+    another (imread/imwrite release the GIL), so reads overlap writes."""
+    with ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+        reads = deque(reader.submit(_read, p) for _, _, p in jobs[:depth])
+        pending = deque()
+        for k, (i, total, p) in enumerate(jobs):
+            img = reads.popleft().result()
+            if k + depth < len(jobs):
+                reads.append(reader.submit(_read, jobs[k + depth][2]))
+            pending.append(writer.submit(_stamp_and_save, i, total, p, img))
+            # bound the number of decoded images held in memory
+            while len(pending) > depth or (pending and pending[0].done()):
+                _emit(pending.popleft().result())
+        while pending:
+            _emit(pending.popleft().result())
+
+def _emit(rec):
+    lvl, m = rec
+    LOG[lvl](m)
 
 # ---------- main ----------
 def main():
@@ -53,6 +99,8 @@ def main():
     ap.add_argument("--bull-radius", type=int, default=16, help="Outer radius of bullseye (px)")
     ap.add_argument("--suffix", default="_final", help="Suffix added before extension for outputs")
     ap.add_argument("--clean-before", action="store_true", help="Clear output folder before writing")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2) - 1),
+                    help="Worker processes (default: CPU count - 1; 1 = serial)")
     args = ap.parse_args()
 
     in_dir, out_dir = Path(args.input), Path(args.output)
@@ -71,25 +119,16 @@ def main():
         sys.exit(1)
 
     total = len(files)
-    log_info(f"Found {total} file(s). Output → {out_dir.resolve()}")
-
-    for i, p in enumerate(files, start=1):
-        prefix = f"[file {i}/{total}]"
-        img = cv2.imread(str(p), cv2.IMREAD_COLOR)
-        if img is None:
-            log_warn(f"{prefix} skip: cannot read {p.name}")
-            continue
-
-        # Add bullseyes in-place
-        add_bullseyes(img, margin=args.bull_margin, radius=args.bull_radius)
-
-        # Save
-        out_path = out_dir / f"{p.stem}{args.suffix}{p.suffix}"
-        ok = cv2.imwrite(str(out_path), img)
-        if not ok:
-            log_warn(f"{prefix} failed to write {out_path.name}")
-        else:
-            log_ok(f"{prefix} {p.name} → {out_path.name}")
+    workers = max(1, min(args.workers, total))
+    log_info(f"Found {total} file(s). Output → {out_dir.resolve()} ({workers} worker(s))")
+
+    jobs = [(i, total, p) for i, p in enumerate(files, start=1)]
+    if workers > 1:
+        for rec in imap_pool(_process_one, jobs, workers, _init_worker, (args, out_dir)):
+            _emit(rec)
+    else:
+        _set_state(args, out_dir)
+        _run_pipelined(jobs)
 
     log_info("Done.")
 
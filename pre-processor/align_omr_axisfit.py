@@ -10,16 +10,21 @@ Output is exactly the template size, with white background.
 
 Usage:
   pip install opencv-python numpy colorama
+  (optional) pip install PyTurboJPEG   # faster JPEG encoding via libjpeg-turbo
   python align_omr_axisfit_noshear.py --input "C:/OMR/in" --output "C:/OMR/out" \
       --template "C:/OMR/omr1-10212025125307_Page1.jpg" --write-debug --keep-debug
 """
 
 from __future__ import annotations
-import argparse, sys, hashlib
+import argparse, os, sys
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from dataclasses import dataclass
 import numpy as np
 import cv2
+from _drawing import add_bullseyes
+from _batch import list_images, clean_outputs, templ_fingerprint, load_npz, save_npz, init_cv_worker, imap_pool
 
 # ---------- colored logs ----------
 try:
@@ -35,6 +40,14 @@ def log_ok(m):   print(C.OK+m+C.END)
 def log_info(m): print(C.INFO+m+C.END)
 def log_warn(m): print(C.WARN+m+C.END)
 def log_err(m):  print(C.ERR+m+C.END)
+LOG = {"ok": log_ok, "info": log_info, "warn": log_warn, "err": log_err}
+
+# ---------- optional: libjpeg-turbo encoder (pip install PyTurboJPEG) ----------
+try:
+    from turbojpeg import TurboJPEG, TJSAMP_420
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
 
 # ---------- data ----------
 @dataclass
@@ -47,77 +60,113 @@ class AxisFids:
 # ---------- helpers ----------
 def to_gray(bgr): return cv2.cvtColor(bgr, cv2.COLOR_BGR2GRAY)
 
-def otsu(gray, invert=False):
+_K3 = cv2.getStructuringElement(cv2.MORPH_RECT, (3,3))
+
+def otsu(gray, invert=False, dst=None):
     mode = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
-    _, bw = cv2.threshold(gray, 0, 255, mode | cv2.THRESH_OTSU)
+    _, bw = cv2.threshold(gray, 0, 255, mode | cv2.THRESH_OTSU, dst=dst)
     return bw
 
-def list_images(folder: Path, exts: tuple[str,...]) -> list[Path]:
-    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in exts])
-
 def clamp(v, lo, hi): return max(lo, min(hi, v))
 
+def _map_pts(M, pts):
+    """Apply a 2x3 affine to a list of (x, y); M=None is the identity."""
+    if M is None: return [tuple(map(float, pt)) for pt in pts]
+    return [(float(M[0,0]*x + M[0,1]*y + M[0,2]), float(M[1,0]*x + M[1,1]*y + M[1,2])) for x, y in pts]
+
+def _med4(a, b, c, d):
+    """Median of four scalars (mean of the middle two, as np.median), without building an array."""
+    lo1, hi1 = (a,b) if a < b else (b,a)
+    lo2, hi2 = (c,d) if c < d else (d,c)
+    return 0.5*(float(max(lo1, lo2)) + float(min(hi1, hi2)))
+
+_REDUCED_GRAY = {2: cv2.IMREAD_REDUCED_GRAYSCALE_2, 4: cv2.IMREAD_REDUCED_GRAYSCALE_4, 8: cv2.IMREAD_REDUCED_GRAYSCALE_8}
+
+def read_detect_gray(path, bgr, scale):
+    """Gray copy of `bgr` at 1/scale size for detection. JPEGs are re-decoded with
+    IMREAD_REDUCED_GRAYSCALE_*, which scales in the DCT domain and skips most of the IDCT."""
+    if scale == 1:
+        return to_gray(bgr)
+    if Path(path).suffix.lower() in (".jpg", ".jpeg"):
+        g = cv2.imread(str(path), _REDUCED_GRAY[scale])
+        if g is not None:
+            return g
+    return cv2.resize(to_gray(bgr), None, fx=1.0/scale, fy=1.0/scale, interpolation=cv2.INTER_AREA)
+
 # ---------- detection ----------
+def _header_segments(band, W, scale, slope_thresh):
+    """Near-horizontal HoughLinesP segments of `band` found at 1/scale size; rows of (x1,y1,x2,y2) in band pixels."""
+    small = band
+    for _ in range(scale.bit_length()-1):
+        small = cv2.pyrDown(small)
+    edges = cv2.Canny(cv2.GaussianBlur(small,(5,5),0), 50, 150, apertureSize=3)
+    segs = cv2.HoughLinesP(edges, 1, np.pi/180, threshold=max(30, 120//scale),
+                           minLineLength=int(0.15*W/scale), maxLineGap=max(5, 20//scale))
+    if segs is None:
+        return np.empty((0,4))
+    S = segs.reshape(-1,4).astype(np.float64) * scale
+    dx = S[:,2]-S[:,0]; dy = S[:,3]-S[:,1]
+    return S[(dx != 0) & (np.abs(dy) < slope_thresh*np.abs(dx))]
+
+def _fit_longest_cluster(S):
+    """Group segments whose slopes chain within 0.03 and intercepts within 15 px, fit the
+    group with the most total length. Returns (m, b, x_min, x_max)."""
+    m = (S[:,3]-S[:,1]) / (S[:,2]-S[:,0] + 1e-6)
+    b = S[:,1] - m*S[:,0]
+    # tolerance grouping by sort-and-split, not fixed bins (a line's segments must never
+    # straddle a cell edge): split sorted slopes at gaps >= 0.03, then each slope group's
+    # sorted intercepts at gaps >= 15 px
+    o = np.argsort(m, kind="stable")
+    gm = np.empty(len(S), np.intp); gm[o] = np.concatenate([[0], np.cumsum(np.diff(m[o]) >= 0.03)])
+    o = np.lexsort((b, gm))
+    cut = (np.diff(gm[o]) != 0) | (np.diff(b[o]) >= 15)
+    lab = np.empty(len(S), np.intp); lab[o] = np.concatenate([[0], np.cumsum(cut)])
+    L = np.hypot(S[:,2]-S[:,0], S[:,3]-S[:,1])
+    best = S[lab == np.argmax(np.bincount(lab, weights=L))]
+
+    X = best[:,[0,2]].ravel(); Y = best[:,[1,3]].ravel()
+    # closed-form 2x2 normal equations (no LAPACK/SVD for a 2-parameter fit)
+    n = X.size; sx = X.sum(); sy = Y.sum(); sxx = (X*X).sum(); sxy = (X*Y).sum()
+    d = n*sxx - sx*sx
+    if abs(d) > 1e-9*max(1.0, n*sxx):
+        m_fit = (n*sxy - sx*sy) / d
+        b_fit = (sy - m_fit*sx) / n
+    else:
+        m_fit, b_fit = np.polyfit(X, Y, 1)
+    return m_fit, b_fit, X.min(), X.max()
+
 def detect_header_line(gray, y0_frac=0.02, y1_frac=0.22, slope_thresh=0.08):
-    """Cluster many Hough segments into the single long header line and fit it."""
+    """Cluster many Hough segments into the single long header line and fit it.
+
+    Wide pages are searched on a pyrDown'd band (x2 above 1200 px, x4 above
+    2400 px); the fit is then refined at full resolution in a thin strip
+    around the coarse line, so the angle keeps full-res precision."""
     H, W = gray.shape
     y0, y1 = int(H*y0_frac), int(H*y1_frac)
     band = gray[y0:y1, :]
+    scale = 1 if W <= 1200 else (2 if W <= 2400 else 4)
 
-    edges = cv2.Canny(cv2.GaussianBlur(band,(5,5),0), 50, 150, apertureSize=3)
-    segs = cv2.HoughLinesP(edges, 1, np.pi/180, threshold=120,
-                           minLineLength=int(0.15*W), maxLineGap=20)
-    if segs is None:
+    S = _header_segments(band, W, scale, slope_thresh)
+    if not len(S):
         row = int(np.argmin(band.mean(axis=1)))
         y = y0 + row
         return (10.0, float(y)), (float(W-10), float(y))
-
-    S = []
-    for x1,y1p,x2,y2p in segs.reshape(-1,4):
-        dx, dy = x2-x1, y2p-y1p
-        if dx == 0: 
-            continue
-        if abs(dy/float(dx)) < slope_thresh:
-            S.append((x1, y1p+y0, x2, y2p+y0))
-
-    if not S:
-        row = int(np.argmin(band.mean(axis=1)))
-        y = y0 + row
-        return (10.0, float(y)), (float(W-10), float(y))
-
-    clusters = []
-    for (x1,y1a,x2,y2a) in S:
-        m = (y2a - y1a) / float((x2 - x1) + 1e-6)
-        b = y1a - m*x1
-        found = False
-        for Cc in clusters:
-            if abs(m - Cc["m"]) < 0.03 and abs(b - Cc["b"]) < 15:
-                Cc["segs"].append((x1,y1a,x2,y2a))
-                Cc["m_list"].append(m); Cc["b_list"].append(b)
-                found = True
-                break
-        if not found:
-            clusters.append({"m":m, "b":b, "segs":[(x1,y1a,x2,y2a)], "m_list":[m], "b_list":[b]})
-
-    best = None; best_len = -1
-    for Cc in clusters:
-        Lsum = 0.0
-        for (x1,y1a,x2,y2a) in Cc["segs"]:
-            Lsum += np.hypot(x2-x1, y2a-y1a)
-        if Lsum > best_len:
-            best_len = Lsum; best = Cc
-
-    pts = []; xs = []
-    for (x1,y1a,x2,y2a) in best["segs"]:
-        pts += [[x1,y1a],[x2,y2a]]
-        xs  += [x1,x2]
-    P = np.array(pts, dtype=np.float32)
-    X = P[:,0]; Y = P[:,1]
-    A = np.vstack([X, np.ones_like(X)]).T
-    m_fit, b_fit = np.linalg.lstsq(A, Y, rcond=None)[0]
-
-    xL = float(max(10, min(xs)))
-    xR = float(min(W-10, max(xs)))
+    S[:,[1,3]] += y0
+    m_fit, b_fit, xmin, xmax = _fit_longest_cluster(S)
+
+    if scale > 1:
+        # bound the strip by the coarse line across the whole band width, not just the
+        # coarse cluster's span: a short coarse pick must not clip a tilted header
+        ya, yb = b_fit, m_fit*(W-1) + b_fit
+        pad = 6*scale
+        r0 = int(max(y0, min(ya, yb) - pad)); r1 = int(min(y1, max(ya, yb) + pad + 1))
+        S = _header_segments(gray[r0:r1, :], W, 1, slope_thresh)
+        if len(S):
+            S[:,[1,3]] += r0
+            m_fit, b_fit, xmin, xmax = _fit_longest_cluster(S)
+
+    xL = float(max(10, xmin))
+    xR = float(min(W-10, xmax))
     yL = float(m_fit*xL + b_fit)
     yR = float(m_fit*xR + b_fit)
     if xL > xR: xL, xR, yL, yR = xR, xL, yR, yL
@@ -130,9 +179,9 @@ def extract_dash_patch_from_template(templ_gray,
     x0 = int(W * x_left_frac); x1 = int(W * x_right_frac)
     roi = templ_gray[:, x0:x1]
 
-    bw = cv2.threshold(roi, 0, 255, cv2.THRESH_BINARY_INV | cv2.THRESH_OTSU)[1]
-    bw = cv2.morphologyEx(bw, cv2.MORPH_OPEN, np.ones((3,3), np.uint8), 1)
-    bw = cv2.morphologyEx(bw, cv2.MORPH_CLOSE, np.ones((3,3), np.uint8), 1)
+    bw = otsu(roi, invert=True)
+    cv2.morphologyEx(bw, cv2.MORPH_OPEN, _K3, dst=bw, iterations=1)
+    cv2.morphologyEx(bw, cv2.MORPH_CLOSE, _K3, dst=bw, iterations=1)
 
     cnts, _ = cv2.findContours(bw, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
     comps = []
@@ -164,11 +213,59 @@ def extract_dash_patch_from_template(templ_gray,
     patch = roi[y0:y1, x0p:x1p]
     return patch.copy()
 
+_res_buf = None
+
+def _match_strip(img, t, metric="ccoeff", bands=4):
+    """Match scores into a result map reused while the strip size stays the same
+    (pages from one scanner), instead of a fresh multi-MB float32 map per page.
+    Higher is always better: for metric="sqdiff" the TM_SQDIFF_NORMED distance d
+    is turned into 1-d in place. The returned array is overwritten by the next call.
+
+    A tall strip is matched as `bands` horizontal bands (overlapping by hT-1 rows)
+    written straight into slices of the map: the smaller DFT blocks run ~30%
+    faster than one pass over the whole strip."""
+    global _res_buf
+    hT = t.shape[0]
+    shape = (img.shape[0]-hT+1, img.shape[1]-t.shape[1]+1)
+    if _res_buf is None or _res_buf.shape != shape:
+        _res_buf = np.empty(shape, np.float32)
+    method = cv2.TM_SQDIFF_NORMED if metric == "sqdiff" else cv2.TM_CCOEFF_NORMED
+    n = bands if shape[0] >= 8*hT*bands else 1
+    edges = [k*shape[0]//n for k in range(n+1)]
+    for a, b in zip(edges, edges[1:]):
+        cv2.matchTemplate(img[a:b+hT-1], t, method, result=_res_buf[a:b])
+    if metric != "sqdiff":
+        return _res_buf
+    return cv2.subtract(1.0, _res_buf, dst=_res_buf)
+
+def _refine_match(roi, t, c, r=8, metric="ccoeff"):
+    """Re-match `t` at full res within ±r px of candidate c=(cx, cy, score); returns the refined candidate."""
+    hT, wT = t.shape[:2]
+    x = int(round(c[0] - wT/2.0)); y = int(round(c[1] - hT/2.0))
+    xa, ya = max(0, x-r), max(0, y-r)
+    xb, yb = min(roi.shape[1], x+r+wT), min(roi.shape[0], y+r+hT)
+    if xb-xa < wT or yb-ya < hT:
+        return c
+    if metric == "sqdiff":
+        res = cv2.matchTemplate(roi[ya:yb, xa:xb], t, cv2.TM_SQDIFF_NORMED)
+        score, _, (bx, by), _ = cv2.minMaxLoc(res); score = 1.0 - score
+    else:
+        res = cv2.matchTemplate(roi[ya:yb, xa:xb], t, cv2.TM_CCOEFF_NORMED)
+        _, score, _, (bx, by) = cv2.minMaxLoc(res)
+    return np.array([xa + bx + wT/2.0, ya + by + hT/2.0, score])
+
 def detect_dash_top_bottom(gray,
                            dash_patch: np.ndarray,
                            x_left_frac=0.03, x_right_frac=0.18,
-                           match_thresh=0.55, min_sep_frac=0.04):
-    """Template-match dashes, keep well-separated peaks, return top & bottom centers."""
+                           match_thresh=0.55, min_sep_frac=0.04, metric="ccoeff", M=None):
+    """Template-match dashes, keep well-separated peaks, return top & bottom centers.
+
+    When the patch is at least 16 px on a side, matching runs on a pyrDown'd
+    strip and the final top/bottom peaks are re-matched at full resolution.
+
+    metric="sqdiff" Otsu-binarizes strip and patch and matches with TM_SQDIFF_NORMED,
+    where 0 is a perfect match. Scores are reported as 1-distance, so `match_thresh`
+    keeps its meaning: 0.55 accepts any position with a distance <= 0.45."""
     H, W = gray.shape
     x0 = int(W * x_left_frac); x1 = int(W * x_right_frac)
     roi = gray[:, x0:x1]
@@ -178,57 +275,82 @@ def detect_dash_top_bottom(gray,
         cx = (x0 + x1)/2.0
         return (float(cx), float(int(H*0.08))), (float(cx), float(int(H*0.92)))
 
-    res = cv2.matchTemplate(roi, t, cv2.TM_CCOEFF_NORMED)
-    ys, xs = np.where(res >= match_thresh)
-    if len(xs) == 0:
-        ys, xs = np.where(res >= (match_thresh*0.9))
-        if len(xs) == 0:
+    if metric == "sqdiff":
+        roi = otsu(roi); t = otsu(t)
+
+    hT, wT = t.shape[:2]
+    s = 2 if min(hT, wT) >= 16 else 1
+    roi_s, t_s = (cv2.pyrDown(roi), cv2.pyrDown(t)) if s > 1 else (roi, t)
+
+    res = _match_strip(roi_s, t_s, metric)
+    # NMS below is on Y only, so a row's best peak suppresses the rest of that row:
+    # collapsing the map to one (x, score) per row first gives the same survivors.
+    row_x = res.argmax(axis=1); row_score = res[np.arange(len(row_x)), row_x]
+    ys = np.flatnonzero(row_score >= match_thresh)
+    if len(ys) == 0:
+        ys = np.flatnonzero(row_score >= (match_thresh*0.9))
+        if len(ys) == 0:
             cx = (x0 + x1)/2.0
             return (float(cx), float(int(H*0.08))), (float(cx), float(int(H*0.92)))
+    xs = row_x[ys]
 
-    hT, wT = t.shape[:2]
-    cand = [[rx + wT/2.0, ry + hT/2.0, float(res[ry,rx])] for (ry,rx) in zip(ys,xs)]
+    # candidates as rows of (cx, cy, score) in full-res ROI pixels, best score first
+    scores = row_score[ys]; order = np.argsort(-scores, kind="stable")
+    cand = np.stack([xs[order]*s + wT/2.0, ys[order]*s + hT/2.0, scores[order]], axis=1)
 
-    # NMS on Y
-    cand.sort(key=lambda c: c[2], reverse=True)
+    # NMS on Y: take the best survivor, drop everything within `sep` rows of it, repeat
     sep = max(6, int(H * min_sep_frac))
-    keep = []
-    for c in cand:
-        if all(abs(c[1]-k[1]) >= sep for k in keep):
-            keep.append(c)
-        if len(keep) > 30: break
-
-    if len(keep) < 2:
-        keep.sort(key=lambda c: c[1])
-        top, bot = keep[0], keep[-1]
-    else:
-        keep.sort(key=lambda c: c[1])
-        top, bot = keep[0], keep[-1]
-
-    cx_avg = (top[0] + bot[0]) / 2.0 + x0
-    return (float(cx_avg), float(top[1])), (float(cx_avg), float(bot[1]))
-
-def detect_axis_fids(gray, dash_patch: np.ndarray) -> AxisFids:
-    """Find both sets of fiducials using the dash template provided."""
-    L, R = detect_header_line(gray)
-    dt, db = detect_dash_top_bottom(gray, dash_patch)
+    alive = np.ones(len(cand), bool); keep = []
+    while len(keep) <= 30 and alive.any():
+        i = int(np.argmax(alive))
+        keep.append(i)
+        alive &= np.abs(cand[:,1] - cand[i,1]) >= sep
+
+    kept = cand[keep]
+    top, bot = kept[np.argmin(kept[:,1])], kept[np.argmax(kept[:,1])]
+    if s > 1:
+        top, bot = _refine_match(roi, t, top, metric=metric), _refine_match(roi, t, bot, metric=metric)
+
+    (tx_, ty_), (bx_, by_) = _map_pts(M, [(top[0] + x0, top[1]), (bot[0] + x0, bot[1])])
+    cx_avg = (tx_ + bx_) / 2.0
+    return (float(cx_avg), float(ty_)), (float(cx_avg), float(by_))
+
+def detect_axis_fids(gray, dash_patch: np.ndarray, header=None, metric="ccoeff", M=None) -> AxisFids:
+    """Find both sets of fiducials using the dash template provided.
+    `header` may carry (L, R) endpoints already measured on this exact image.
+    With a 2x3 affine `M` (e.g. the deskew rotation), fiducials are found on the
+    image as given and reported in M's output frame, so the image need not be warped."""
+    L, R = _map_pts(M, header if header is not None else detect_header_line(gray))
+    dt, db = detect_dash_top_bottom(gray, dash_patch, metric=metric, M=M)
     if dt[1] > db[1]: dt, db = db, dt
     if L[0] > R[0]:   L, R = R, L
     return AxisFids(L, R, dt, db)
 
+def scale_fids(f: AxisFids, s) -> AxisFids:
+    """Map fiducials found on a 1/s detection image back to full-resolution pixels."""
+    if s == 1: return f
+    sc = lambda pt: (pt[0]*s, pt[1]*s)
+    return AxisFids(sc(f.line_L), sc(f.line_R), sc(f.dash_top), sc(f.dash_bottom))
+
 # ---------- deskew ----------
-def deskew_by_header(gray):
-    (x1,y1),(x2,y2) = detect_header_line(gray)
-    angle = np.degrees(np.arctan2((y2-y1),(x2-x1)))
-    H,W = gray.shape
-    M = cv2.getRotationMatrix2D((W/2,H/2), -angle, 1.0)
-    rot = cv2.warpAffine(gray, M, (W,H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-    return rot, M, angle
-
-def apply_affine_color(img, M):
+def measure_skew_angle(gray):
+    """Angle (degrees) of the header line, plus the (L, R) endpoints it was measured from."""
+    (x1,y1),(x2,y2) = L, R = detect_header_line(gray)
+    return float(np.degrees(np.arctan2((y2-y1),(x2-x1)))), (L, R)
+
+def rotation_matrix(shape, angle):
+    """2x3 rotation about the image center that makes a line at `angle` degrees horizontal."""
+    H,W = shape[:2]
+    return cv2.getRotationMatrix2D((W/2,H/2), angle, 1.0)
+
+def apply_rotation(img, M):
     H,W = img.shape[:2]
     return cv2.warpAffine(img, M, (W,H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
 
+def compose_affine(A, B):
+    """2x3 affine equivalent to applying B, then A."""
+    return (np.vstack([A, (0,0,1)]) @ np.vstack([B, (0,0,1)]))[:2]
+
 # ---------- fit noshear transform ----------
 def fit_scale_translate(page, templ, sx_clamp=(0.85,1.20), sy_clamp=(0.85,1.20)):
     # X-scale from header lengths
@@ -242,21 +364,14 @@ def fit_scale_translate(page, templ, sx_clamp=(0.85,1.20), sy_clamp=(0.85,1.20))
     sy = clamp(St / Sp, *sy_clamp)
 
     # Robust offsets: compute from all four corresponding points, take median
-    tx_candidates = np.array([
-        templ.line_L[0]     - sx*page.line_L[0],
-        templ.line_R[0]     - sx*page.line_R[0],
-        templ.dash_top[0]   - sx*page.dash_top[0],
-        templ.dash_bottom[0]- sx*page.dash_bottom[0],
-    ], dtype=np.float32)
-    ty_candidates = np.array([
-        templ.line_L[1]     - sy*page.line_L[1],
-        templ.line_R[1]     - sy*page.line_R[1],
-        templ.dash_top[1]   - sy*page.dash_top[1],
-        templ.dash_bottom[1]- sy*page.dash_bottom[1],
-    ], dtype=np.float32)
-
-    tx = float(np.median(tx_candidates))
-    ty = float(np.median(ty_candidates))
+    tx = _med4(templ.line_L[0]     - sx*page.line_L[0],
+               templ.line_R[0]     - sx*page.line_R[0],
+               templ.dash_top[0]   - sx*page.dash_top[0],
+               templ.dash_bottom[0]- sx*page.dash_bottom[0])
+    ty = _med4(templ.line_L[1]     - sy*page.line_L[1],
+               templ.line_R[1]     - sy*page.line_R[1],
+               templ.dash_top[1]   - sy*page.dash_top[1],
+               templ.dash_bottom[1]- sy*page.dash_bottom[1])
 
     M = np.array([[sx, 0.0, tx],
                   [0.0, sy, ty]], dtype=np.float32)
@@ -270,30 +385,21 @@ def draw_debug(img, f: AxisFids):
     for pt in [f.dash_top, f.dash_bottom]:
         cv2.drawMarker(img,(int(pt[0]),int(pt[1])),(0,0,255),cv2.MARKER_CROSS,22,3)
 
-def add_bullseyes(img, margin=22, radius=16):
-    H,W = img.shape[:2]
-    for (x,y) in [(margin,margin),(W-margin,margin),(margin,H-margin),(W-margin,H-margin)]:
-        for col,r in [((0,0,0),radius),((255,255,255),int(radius*0.55)),((0,0,0),int(radius*0.25))]:
-            cv2.circle(img,(x,y),r,col,-1,cv2.LINE_AA)
-        cv2.circle(img,(x,y),max(1,radius//10),(255,255,255),-1,cv2.LINE_AA)
-
 # ---------- optional: dash patch cache ----------
-def _templ_fingerprint(path: str) -> str:
-    h = hashlib.sha1()
-    with open(path, "rb") as f:
-        for chunk in iter(lambda: f.read(1<<16), b""):
-            h.update(chunk)
-    return h.hexdigest()[:16]
-
-def load_or_build_dash_patch(templ_gray, templ_path: str, user_patch_path: str, cache_dir: str):
+def load_or_build_dash_patch(templ_gray, templ_path: str, user_patch_path: str, cache_dir: str, scale=1):
+    """Dash patch at 1/scale resolution. A user-supplied --dash-patch is full-resolution
+    (as cut from the template) and is shrunk to match the detect-scale pages."""
     if user_patch_path:
         patch = cv2.imread(user_patch_path, cv2.IMREAD_GRAYSCALE)
         if patch is None or patch.size == 0:
             raise RuntimeError(f"Cannot read dash patch: {user_patch_path}")
+        if scale > 1:
+            h, w = patch.shape
+            patch = cv2.resize(patch, (max(1, round(w/scale)), max(1, round(h/scale))), interpolation=cv2.INTER_AREA)
         return patch
-    fp = _templ_fingerprint(templ_path)
+    fp = templ_fingerprint(templ_path)
     cache = Path(cache_dir); cache.mkdir(parents=True, exist_ok=True)
-    cache_path = cache / f"dash_{fp}.png"
+    cache_path = cache / (f"dash_{fp}.png" if scale == 1 else f"dash_{fp}_r{scale}.png")
     if cache_path.exists():
         patch = cv2.imread(str(cache_path), cv2.IMREAD_GRAYSCALE)
         if patch is not None and patch.size > 0:
@@ -304,6 +410,150 @@ def load_or_build_dash_patch(templ_gray, templ_path: str, user_patch_path: str,
     cv2.imwrite(str(cache_path), patch)
     return patch
 
+def load_or_build_template_state(templ_path: str, user_patch_path: str, cache_dir: str, scale=1, metric="ccoeff"):
+    """Return (dash_patch, full-res template AxisFids, (Ht, Wt)).
+
+    Auto-built patches are cached together with the template fiducials in one
+    .npz per template/scale/metric, so a repeat run neither decodes nor measures
+    the template. A user-supplied patch is always measured fresh."""
+    cache_path = None
+    if not user_patch_path:
+        cache = Path(cache_dir); cache.mkdir(parents=True, exist_ok=True)
+        cache_path = cache / f"tstate_{templ_fingerprint(templ_path)}_r{scale}_{metric}.npz"
+        z = load_npz(cache_path, ("patch", "shape", "fids"))  # None: missing or bad, rebuild below
+        if z is not None:
+            fids = AxisFids(*(tuple(pt) for pt in z["fids"].tolist()))
+            return z["patch"], fids, tuple(int(v) for v in z["shape"])
+    templ = cv2.imread(str(templ_path))
+    if templ is None:
+        raise RuntimeError(f"Cannot read template: {templ_path}")
+    # template is measured at the same reduced scale as the pages
+    templ_gray = read_detect_gray(templ_path, templ, scale)
+    patch = load_or_build_dash_patch(templ_gray, templ_path, user_patch_path, cache_dir, scale=scale)
+    t_fids = scale_fids(detect_axis_fids(templ_gray, patch, metric=metric), scale)
+    if cache_path is not None:
+        save_npz(cache_path, patch=patch, shape=np.array(templ.shape[:2]),
+                 fids=np.array([t_fids.line_L, t_fids.line_R, t_fids.dash_top, t_fids.dash_bottom], np.float64))
+    return patch, t_fids, templ.shape[:2]
+
+# ---------- per-file worker ----------
+# template state and options, set once per worker process (see _batch.imap_pool)
+_dash_patch = _t_fids = _args = _out_dir = _sx_clamp = _sy_clamp = None
+_Ht = _Wt = 0
+
+def _set_state(dash_patch, t_fids, Ht, Wt, args, out_dir, sx_clamp, sy_clamp):
+    global _dash_patch, _t_fids, _Ht, _Wt, _args, _out_dir, _sx_clamp, _sy_clamp
+    _dash_patch, _t_fids, _Ht, _Wt = dash_patch, t_fids, Ht, Wt
+    _args, _out_dir, _sx_clamp, _sy_clamp = args, out_dir, sx_clamp, sy_clamp
+
+def _init_worker(*state):
+    _set_state(*state)
+    init_cv_worker(opencl=_args.opencl)
+
+def _emit(recs):
+    for lvl, m in recs: LOG[lvl](m)
+
+def _read(p):
+    """Full-res color page (for the final warp) and reduced gray page (for detection)."""
+    bgr = cv2.imread(str(p))
+    if bgr is None:
+        return None, None
+    return bgr, read_detect_gray(p, bgr, _args.detect_scale)
+
+def _align_one(i, total, p, frame):
+    """Deskew, fit and warp one decoded page; returns (records, [(out_path, img), ...])."""
+    args, out_dir = _args, _out_dir
+    prefix=f"[file {i}/{total}]"
+    bgr, g = frame
+    if bgr is None:
+        return [("warn", f"{prefix} skip: cannot read {p.name}")], []
+    recs=[]; writes=[]
+
+    # 1) Deskew (rotate only) using header line; straight pages are left untouched.
+    #    No image is rotated here: the fiducials are mapped through the rotation in
+    #    step 2, and the color page is warped once, in step 4.
+    angle, header = measure_skew_angle(g)
+    Mrot = Mg = None
+    if abs(angle) > 0.1:
+        Mg, Mrot = rotation_matrix(g.shape, angle), rotation_matrix(bgr.shape, angle)
+
+    # 2) Detect fiducials (using SAME dash patch) in deskewed coordinates, then back to full-res pixels
+    g_fids = detect_axis_fids(g, _dash_patch, header, _args.match_metric, M=Mg)
+    p_fids = scale_fids(g_fids, args.detect_scale)
+
+    # 3) Fit no-shear SX/SY + translation to template
+    Mst, sx, sy, tx, ty = fit_scale_translate(p_fids, _t_fids,
+                                              sx_clamp=_sx_clamp,
+                                              sy_clamp=_sy_clamp)
+
+    # 4) Warp the original page directly to template canvas (uniform size), white background
+    #    (--opencl: on the OpenCL device via a UMat, then back to host for bullseyes/encode)
+    M = Mst if Mrot is None else compose_affine(Mst, Mrot)
+    warped = cv2.warpAffine(cv2.UMat(bgr) if args.opencl else bgr, M, (_Wt, _Ht),
+                            flags=cv2.INTER_LINEAR,
+                            borderMode=cv2.BORDER_CONSTANT,
+                            borderValue=(255,255,255))
+    if args.opencl: warped = warped.get()
+
+    # 5) Add bullseyes
+    add_bullseyes(warped, margin=args.bull_margin, radius=args.bull_radius)
+
+    # 6) Queue for saving
+    out_final = out_dir / f"{p.stem}_final.jpg"
+    writes.append((out_final, warped))
+
+    if args.write_debug:
+        # deskewed detection image, so detection coordinates
+        sd = cv2.cvtColor(g if Mg is None else apply_rotation(g, Mg), cv2.COLOR_GRAY2BGR)
+        draw_debug(sd, g_fids)
+        cv2.line(sd, (int(g_fids.line_L[0]),int(g_fids.line_L[1])),
+                     (int(g_fids.line_R[0]),int(g_fids.line_R[1])), (255,0,0), 2)
+        writes.append((out_dir / f"{p.stem}_debug.jpg", sd))
+        recs.append(("info", f"{prefix} sx={sx:.4f} sy={sy:.4f} tx={tx:.1f} ty={ty:.1f} angle={angle:.2f}"))
+
+    recs.append(("ok", f"{prefix} {p.name} → {out_final.name}"))
+    return recs, writes
+
+def _imwrite(path: Path, img, quality):
+    """JPEGs go through libjpeg-turbo when PyTurboJPEG is available, else cv2; both at `quality`."""
+    if path.suffix.lower() not in (".jpg", ".jpeg"):
+        cv2.imwrite(str(path), img); return
+    if _tj is not None and img.ndim == 3:
+        with open(path, "wb") as f:
+            f.write(_tj.encode(img, quality=quality, jpeg_subsample=TJSAMP_420))
+    else:
+        cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+
+def _save(writes):
+    """Write one page's outputs; stale files are removed once, after the batch."""
+    for path, img in writes:
+        _imwrite(path, img, _args.jpeg_quality)
+
+def _process_one(job):
+    """Pool task: read, align and save one page; returns [(level, message), ...]."""
+    i, total, p = job
+    recs, writes = _align_one(i, total, p, _read(p))
+    _save(writes)
+    return recs
+
+def _run_pipelined(jobs, depth=4):
+    """In-process path: decode up to `depth` pages ahead and encode behind on
+    helper threads (imread/imwrite release the GIL), so disk I/O overlaps compute."""
+    with ThreadPoolExecutor(1) as reader, ThreadPoolExecutor(1) as writer:
+        reads = deque(reader.submit(_read, p) for _,_,p in jobs[:depth])
+        pending = deque()
+        for k, (i, total, p) in enumerate(jobs):
+            frame = reads.popleft().result()
+            if k + depth < len(jobs):
+                reads.append(reader.submit(_read, jobs[k+depth][2]))
+            recs, writes = _align_one(i, total, p, frame)
+            pending.append((writer.submit(_save, writes), recs))
+            # bound the number of warped pages held in memory
+            while len(pending) > depth or (pending and pending[0][0].done()):
+                fut, recs = pending.popleft(); fut.result(); _emit(recs)
+        for fut, recs in pending:
+            fut.result(); _emit(recs)
+
 # ---------- main ----------
 def main():
     ap=argparse.ArgumentParser("Axis-fit OMR alignment without shear")
@@ -321,10 +571,26 @@ def main():
     ap.add_argument("--sy-range", type=str, default="0.8,1.25",
                     help="Clamp for Y scale ratio St/Sp, e.g. 0.85,1.2")
     # NEW: dash-patch persistence (optional)
-    ap.add_argument("--dash-patch", default="", help="Optional path to a saved dash-patch PNG.")
-    ap.add_argument("--dash-cache-dir", default=".dash_cache", help="Folder to cache auto-built dash patches.")
+    ap.add_argument("--dash-patch", default="",
+                    help="Optional path to a saved dash-patch PNG.")
+    ap.add_argument("--dash-cache-dir", default=".dash_cache", help="Folder to cache auto-built dash patches and template fiducials.")
+    ap.add_argument("--detect-scale", type=int, choices=(1,2,4,8), default=2,
+                    help="Find fiducials on a 1/N-size gray image (JPEGs decode directly at that size)")
+    ap.add_argument("--match-metric", choices=("ccoeff","sqdiff"), default="ccoeff",
+                    help="Dash matching: ccoeff (gray TM_CCOEFF_NORMED) or sqdiff (Otsu-binarized TM_SQDIFF_NORMED)")
+    ap.add_argument("--jpeg-quality", type=int, default=85,
+                    help="JPEG quality (1-100) for written pages; lower is smaller and faster to encode")
+    ap.add_argument("--opencl", action="store_true",
+                    help="Warp pages on an OpenCL device (OpenCV T-API) when one is available")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2)-1),
+                    help="Worker processes (default: CPU count - 1; 1 = serial)")
     args=ap.parse_args()
 
+    if args.opencl:
+        cv2.ocl.setUseOpenCL(True)
+        if not cv2.ocl.useOpenCL():
+            log_warn("--opencl: no usable OpenCL device, warping on the CPU"); args.opencl = False
+
     sx_lo, sx_hi = [float(x) for x in args.sx_range.split(",")]
     sy_lo, sy_hi = [float(x) for x in args.sy_range.split(",")]
 
@@ -341,87 +607,35 @@ def main():
     if not files:
         log_err(f"No images with {exts} in {in_dir}"); sys.exit(1)
 
-    # Template
-    templ=cv2.imread(str(args.template))
-    if templ is None:
-        log_err(f"Cannot read template: {args.template}"); sys.exit(1)
-    templ_gray = to_gray(templ)
-
-    # Build or load dash patch ONCE, then keep it in memory
-    dash_patch = load_or_build_dash_patch(templ_gray, args.template, args.dash_patch, args.dash_cache_dir)
-
-    # Detect fiducials on template (with same dash patch)
-    t_fids = detect_axis_fids(templ_gray, dash_patch)
-    Ht, Wt = templ_gray.shape
+    # Template: dash patch + fiducials, built ONCE (or loaded from the cache) and kept in memory
+    try:
+        dash_patch, t_fids, (Ht, Wt) = load_or_build_template_state(
+            args.template, args.dash_patch, args.dash_cache_dir, scale=args.detect_scale, metric=args.match_metric)
+    except RuntimeError as e:
+        log_err(str(e)); sys.exit(1)
 
     if args.write_debug:
-        td = templ.copy(); draw_debug(td, t_fids)
+        td = cv2.imread(str(args.template)); draw_debug(td, t_fids)
         cv2.imwrite(str(out_dir/"_template_debug.jpg"), td)
-        cv2.imwrite(str(out_dir/"_dash_patch.png"), dash_patch)
+        # saved at full resolution, so it can be passed back in as --dash-patch
+        s = args.detect_scale
+        cv2.imwrite(str(out_dir/"_dash_patch.png"),
+                    dash_patch if s == 1 else cv2.resize(dash_patch, None, fx=s, fy=s, interpolation=cv2.INTER_CUBIC))
 
     total=len(files)
-    log_info(f"Found {total} file(s). Output → {out_dir.resolve()}")
-
-    for i,p in enumerate(files, start=1):
-        prefix=f"[file {i}/{total}]"
-        bgr=cv2.imread(str(p))
-        if bgr is None:
-            log_warn(f"{prefix} skip: cannot read {p.name}")
-            continue
-
-        g = to_gray(bgr)
-
-        # 1) Deskew (rotate only) using header line
-        g_rot, Mrot, angle = deskew_by_header(g)
-        if abs(angle) > 0.1:
-            bgr = apply_affine_color(bgr, Mrot)
-            g   = g_rot
-
-        # 2) Detect fiducials on deskewed page (using SAME dash patch)
-        p_fids = detect_axis_fids(g, dash_patch)
-
-        # 3) Fit no-shear SX/SY + translation to template
-        Mst, sx, sy, tx, ty = fit_scale_translate(p_fids, t_fids,
-                                                  sx_clamp=(sx_lo, sx_hi),
-                                                  sy_clamp=(sy_lo, sy_hi))
-
-        # 4) Warp directly to template canvas (uniform size), white background
-        warped = cv2.warpAffine(bgr, Mst, (Wt, Ht),
-                                flags=cv2.INTER_LINEAR,
-                                borderMode=cv2.BORDER_CONSTANT,
-                                borderValue=(255,255,255))
-
-        # 5) Add bullseyes
-        add_bullseyes(warped, margin=args.bull_margin, radius=args.bull_radius)
-
-        # 6) Save
-        out_final = out_dir / f"{p.stem}_final.jpg"
-        cv2.imwrite(str(out_final), warped)
-
-        if args.write_debug:
-            sd = cv2.cvtColor(g, cv2.COLOR_GRAY2BGR)
-            draw_debug(sd, p_fids)
-            cv2.line(sd, (int(p_fids.line_L[0]),int(p_fids.line_L[1])),
-                         (int(p_fids.line_R[0]),int(p_fids.line_R[1])), (255,0,0), 2)
-            cv2.imwrite(str(out_dir / f"{p.stem}_debug.jpg"), sd)
-            log_info(f"{prefix} sx={sx:.4f} sy={sy:.4f} tx={tx:.1f} ty={ty:.1f} angle={angle:.2f}")
-
-        # keep only final unless --keep-debug
-        for q in out_dir.glob(f"{p.stem}_*.*"):
-            if q.name == out_final.name: continue
-            if args.keep_debug and q.name.endswith("_debug.jpg"): continue
-            try: q.unlink()
-            except Exception: pass
-
-        log_ok(f"{prefix} {p.name} → {out_final.name}")
+    workers=max(1, min(args.workers, total))
+    log_info(f"Found {total} file(s). Output → {out_dir.resolve()} ({workers} worker(s))")
+
+    state=(dash_patch, t_fids, Ht, Wt, args, out_dir, (sx_lo, sx_hi), (sy_lo, sy_hi))
+    jobs=[(i, total, p) for i,p in enumerate(files, start=1)]
+    if workers > 1:
+        for recs in imap_pool(_process_one, jobs, workers, _init_worker, state):
+            _emit(recs)
+    else:
+        _set_state(*state)
+        _run_pipelined(jobs)
 
-    # cleanup pass
-    for q in out_dir.glob("*"):
-        if q.suffix.lower()==".jpg" and not q.name.endswith("_final.jpg"):
-            if args.keep_debug and q.name.endswith("_debug.jpg"):
-                continue
-            try: q.unlink()
-            except Exception: pass
+    clean_outputs(out_dir, (p.stem for p in files), keep_debug=args.keep_debug)
 
     log_info("Done. All outputs are the same pixel size as the template.")
 
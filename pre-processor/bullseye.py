@@ -11,6 +11,8 @@ from __future__ import annotations
 import argparse, sys
 from pathlib import Path
 import cv2
+from _drawing import add_bullseyes
+from _batch import list_images
 
 # ---------- colored logs ----------
 try:
@@ -27,22 +29,6 @@ def log_info(m): print(C.INFO+m+C.END)
 def log_warn(m): print(C.WARN+m+C.END)
 def log_err(m):  print(C.ERR+m+C.END)
 
-# ---------- helpers ----------
-def list_images(folder: Path, exts: tuple[str,...]) -> list[Path]:
-    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in exts])
-
-def add_bullseyes(img, margin=22, radius=16):
-    """Draws black/white/black concentric circles in all 4 corners."""
-    H, W = img.shape[:2]
-    corners = [(margin, margin), (W - margin, margin),
-               (margin, H - margin), (W - margin, H - margin)]
-    for (x, y) in corners:
-        for col, r in [((0, 0, 0), radius),
-                       ((255, 255, 255), int(radius * 0.55)),
-                       ((0, 0, 0), int(radius * 0.25))]:
-            cv2.circle(img, (int(x), int(y)), max(1, int(r)), col, -1, lineType=cv2.LINE_AA)
-        cv2.circle(img, (int(x), int(y)), max(1, radius // 10), (255, 255, 255), -1, lineType=cv2.LINE_AA)
-
 # ---------- main ----------
 def main():
     ap = argparse.ArgumentParser("Add four bullseyes to images")
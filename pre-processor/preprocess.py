@@ -1,7 +1,7 @@
 #!/usr/bin/env python3
 """
 Robust OMR alignment:
-  1) Coarse deskew by the header band (Hough) to make the top line horizontal.
+  1) Coarse deskew by the header band (projection profile) to make the top line horizontal.
   2) Template-anchored detection of 4 fiducials:
       • top dash (left dashed margin – topmost block center)
       • bottom dash (left dashed margin – bottommost block center)
@@ -11,17 +11,20 @@ Robust OMR alignment:
   4) Draw bullseyes in 4 corners; keep one *_final.jpg per input.
 
 Install:  pip install opencv-python numpy colorama
+          (optional) pip install PyTurboJPEG   # faster JPEG decode/encode via libjpeg-turbo
 Run:
   python align_omr_robust.py --input "C:/OMR/in" --output "C:/OMR/out" \
      --template "C:/OMR/in/omr1-10212025125307_Page1.jpg" --write-debug
 """
 
 from __future__ import annotations
-import argparse, sys
+import argparse, os, sys
 from pathlib import Path
 from dataclasses import dataclass
 import numpy as np
 import cv2
+from _drawing import add_bullseyes
+from _batch import list_images, clean_outputs, templ_fingerprint, load_npz, save_npz, init_cv_worker, imap_pool
 
 # ---------- colored logs ----------
 try:
@@ -37,6 +40,14 @@ def log_info(m): print(f"{C.INFO}{m}{C.END}")
 def log_ok(m):   print(f"{C.OK}{m}{C.END}")
 def log_warn(m): print(f"{C.WARN}{m}{C.END}")
 def log_err(m):  print(f"{C.ERR}{m}{C.END}")
+LOG = {"ok": log_ok, "info": log_info, "warn": log_warn, "err": log_err}
+
+# ---------- optional: libjpeg-turbo codec (pip install PyTurboJPEG) ----------
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJPF_GRAY, TJSAMP_420
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
 
 # ---------- datatypes ----------
 @dataclass
@@ -54,15 +65,60 @@ class FourFidsNorm:
     thin_line_right: tuple[float,float]
 
 # ---------- utils ----------
-def list_images(folder: Path, exts: tuple[str,...]) -> list[Path]:
-    return sorted([p for p in folder.iterdir() if p.is_file() and p.suffix.lower() in exts])
-
 def to_gray(img): return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
 
-def otsu(gray, invert=False):
-    mode = cv2.THRESH_BINARY_INV if invert else cv2.THRESH_BINARY
-    _, bw = cv2.threshold(gray, 0, 255, mode | cv2.THRESH_OTSU)
-    return bw
+def _exif_orientation(buf: bytes):
+    """EXIF Orientation (1-8) of a JPEG byte string; 1 if it has no such tag, None if the
+    header can't be walked. Only markers before the first scan are read."""
+    if buf[:2] != b"\xff\xd8": return None
+    i = 2
+    while i + 4 <= len(buf):
+        if buf[i] != 0xFF: return None
+        marker, n = buf[i+1], int.from_bytes(buf[i+2:i+4], "big")
+        if marker == 0xDA: return 1  # start of scan: no metadata after this
+        if marker == 0xE1 and buf[i+4:i+10] == b"Exif\0\0":
+            t = i + 10; bo = "little" if buf[t:t+2] == b"II" else "big"
+            ifd = t + int.from_bytes(buf[t+4:t+8], bo)
+            for k in range(int.from_bytes(buf[ifd:ifd+2], bo)):
+                e = ifd + 2 + 12*k
+                if int.from_bytes(buf[e:e+2], bo) == 0x0112:
+                    return int.from_bytes(buf[e+8:e+10], bo)
+            return 1
+        i += 2 + n
+    return None
+
+def _tj_decode(p: Path, pixel_format):
+    """libjpeg-turbo decode of a JPEG page, or None -> caller falls back to cv2.imread.
+    PyTurboJPEG ignores EXIF orientation while cv2.imread applies it, so pages whose
+    Orientation isn't 1 (rotated phone scans) are left to cv2: same geometry either way."""
+    if _tj is None or p.suffix.lower() not in (".jpg", ".jpeg"): return None
+    try:
+        with open(p, "rb") as f: buf = f.read()
+        if _exif_orientation(buf) != 1: return None
+        return _tj.decode(buf, pixel_format=pixel_format)
+    except Exception:
+        return None
+
+def read_bgr_gray(p: Path):
+    """Decode a page once -> (bgr, gray), or (None, None) if unreadable.
+    JPEGs go through libjpeg-turbo when PyTurboJPEG is installed, else cv2.imread."""
+    img = _tj_decode(p, TJPF_BGR) if _tj is not None else None
+    if img is None: img = cv2.imread(str(p))
+    if img is None: return None, None
+    return img, to_gray(img)
+
+def read_gray(p: Path):
+    """Decode straight to 8-bit gray (no BGR buffer, no cvtColor), or None if unreadable."""
+    g = _tj_decode(p, TJPF_GRAY) if _tj is not None else None
+    if g is not None: return g[:, :, 0]
+    return cv2.imread(str(p), cv2.IMREAD_GRAYSCALE)
+
+def imwrite_jpeg(path: Path, img, quality=85):
+    """JPEGs go through libjpeg-turbo when PyTurboJPEG is available, else cv2; both at `quality`."""
+    if _tj is not None and img.ndim == 3:
+        path.write_bytes(_tj.encode(img, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420))
+    else:
+        cv2.imwrite(str(path), img, [cv2.IMWRITE_JPEG_QUALITY, quality])
 
 # REPLACE your align step with this function
 def compute_affine_and_warp(mov_bgr, templ_bgr, mov_fids, templ_fids):
@@ -80,6 +136,13 @@ def compute_affine_and_warp(mov_bgr, templ_bgr, mov_fids, templ_fids):
                             borderMode=cv2.BORDER_REPLICATE)
     return warped, A
 
+# corner order is TL, TR, BL, BR -> sides top, bottom, left, right
+_SIDES = np.array([[0,1],[2,3],[0,2],[1,3]])
+
+def _side_lengths(quad):
+    """Lengths (top, bottom, left, right) of a warped corner quad, in one vectorized norm."""
+    return np.linalg.norm(quad[_SIDES[:,0]] - quad[_SIDES[:,1]], axis=1)
+
 # OPTIONAL: only if you explicitly pass --allow-homography
 def try_homography_safe(mov_bgr, templ_bgr, mov_fids, templ_fids):
     Ht, Wt = templ_bgr.shape[:2]
@@ -97,9 +160,7 @@ def try_homography_safe(mov_bgr, templ_bgr, mov_fids, templ_fids):
         left_x= (warped[0,0]+warped[2,0])/2.0; right_x= (warped[1,0]+warped[3,0])/2.0
         if not (top_y < bot_y and left_x < right_x): return False
         # side balance
-        d = lambda a,b: np.hypot(*(a-b))
-        w1, w2 = d(warped[0],warped[1]), d(warped[2],warped[3])
-        h1, h2 = d(warped[0],warped[2]), d(warped[1],warped[3])
+        w1, w2, h1, h2 = _side_lengths(warped)
         if max(w1,w2)/max(1.0,min(w1,w2)) > 2.0: return False
         if max(h1,h2)/max(1.0,min(h1,h2)) > 2.0: return False
         return True
@@ -112,31 +173,63 @@ def try_homography_safe(mov_bgr, templ_bgr, mov_fids, templ_fids):
     return None, None
 
 # ---------- coarse deskew ----------
-def coarse_deskew_by_header(gray, max_rotate=25.0):
-    """Find the longest near-horizontal line in the top 25% and rotate the page to make it horizontal."""
+def _angles_from(c, half, step):
+    """c, c∓step, c±step, ... out to ±half: ties in argmax resolve to the angle nearest c."""
+    o=np.arange(1, int(round(half/step))+1)*step
+    return np.concatenate([[c], np.column_stack([c-o, c+o]).ravel()])
+
+def coarse_deskew_by_header(gray, max_rotate=25.0, scale=2, blocks=32):
+    """Projection-profile deskew of the top 25%; return (angle, M), the rotation that
+    makes the header rows horizontal. Nothing is warped here: callers fold M into
+    their own warp (see to3x3) or rotate just what they need with apply_rotation.
+
+    The band (shrunk 1/scale) is cut into `blocks` column strips whose row sums are
+    taken once. Rotating by a small angle a ~ shifting strip k by x_k*tan(a) rows,
+    so each candidate profile is a sum of shifted strip profiles; the angle whose
+    profile has the largest variance (sharpest dark rows) wins. Search: 1° steps
+    over ±max_rotate, then 0.05° steps within ±1° of the best."""
     H,W=gray.shape
-    band=gray[:int(H*0.25), :]
-    edges=cv2.Canny(cv2.GaussianBlur(band,(5,5),0), 50,150,apertureSize=3)
-    lines=cv2.HoughLines(edges, 1, np.pi/180, 180)
-    angle=0.0
-    if lines is not None:
-        best=None; bestw=0
-        for rho,theta in lines[:,0,:]:
-            # prefer lines near horizontal (theta ~ 0 or pi)
-            dev=min(abs(theta-0), abs(theta-np.pi))
-            w=1.0/(1e-6+dev)
-            if w>bestw:
-                bestw=w; best=theta
-        if best is not None:
-            # rotation angle in degrees to make header horizontal
-            delta = min(best, np.pi-best)
-            angle = -(delta*180/np.pi) if best < np.pi/2 else (delta*180/np.pi)
-            angle = np.clip(angle, -max_rotate, max_rotate)
+    band=cv2.resize(gray[:int(H*0.25), :], None, fx=1.0/scale, fy=1.0/scale, interpolation=cv2.INTER_AREA)
+    h,w=band.shape; bw=w//blocks
+    ink=cv2.bitwise_not(band[:, :bw*blocks]).reshape(h*blocks, bw)
+    prof_k=cv2.reduce(ink, 1, cv2.REDUCE_SUM, dtype=cv2.CV_32F).reshape(h, blocks).T
+    xk=(np.arange(blocks)+0.5)*bw - w/2.0
+    pad=int(np.ceil(w/2*np.tan(np.radians(max_rotate))))+1
+    P=np.zeros((blocks, h+2*pad), np.float32); P[:, pad:pad+h]=prof_k
+    rows=np.arange(h)
+
+    def best(angs):
+        sh=np.rint(np.outer(np.tan(np.radians(angs)), xk)).astype(np.intp) + pad
+        prof=np.zeros((len(angs), h), np.float32)
+        for k in range(blocks):
+            prof += P[k][sh[:,k,None] + rows]
+        return float(angs[int(np.argmax(prof.var(axis=1)))])
+
+    angle=best(_angles_from(0.0, max_rotate, 1.0))
+    angle=best(_angles_from(angle, 1.0, 0.05))
     M=cv2.getRotationMatrix2D((W/2,H/2), angle, 1.0)
-    rot=cv2.warpAffine(gray, M, (W,H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-    return rot, angle, M
+    return angle, M
+
+def apply_rotation(img, M):
+    H,W=img.shape[:2]
+    return cv2.warpAffine(img, M, (W,H), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
+def _host(m):
+    """UMat (OpenCL result) -> ndarray; ndarrays pass through."""
+    return m.get() if isinstance(m, cv2.UMat) else m
+
+def to3x3(M):
+    """2x3 affine -> 3x3 homogeneous matrix, so warps can be chained with @."""
+    return np.vstack([M, [0.0, 0.0, 1.0]])
 
 # ---------- measurements ----------
+def crop_rotated(gray, x0, y0, x1, y1, M=None):
+    """gray[y0:y1, x0:x1] of the page as rotated by M (None = unrotated). Only the
+    ROI is resampled: M is shifted so the ROI origin lands at (0,0)."""
+    if M is None: return gray[y0:y1, x0:x1]
+    Ms = M.copy(); Ms[0,2] -= x0; Ms[1,2] -= y0
+    return cv2.warpAffine(gray, Ms, (x1-x0, y1-y0), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
+
 def avg_y_of_longest_horizontal(gray_band, min_len_px, strict=True):
     blur=cv2.GaussianBlur(gray_band,(5,5),0)
     edges=cv2.Canny(blur,50,150,apertureSize=3)
@@ -145,52 +238,50 @@ def avg_y_of_longest_horizontal(gray_band, min_len_px, strict=True):
     ml=int(min_len_px if strict else 0.7*min_len_px)
     lines=cv2.HoughLinesP(edges,1,np.pi/180, threshold=th, minLineLength=ml, maxLineGap=mg)
     if lines is not None:
-        best=None; Lbest=-1
-        for x1,y1,x2,y2 in lines.reshape(-1,4):
-            if x2==x1: continue
-            slope=abs((y2-y1)/float(x2-x1))
-            if slope<0.08:
-                L=np.hypot(x2-x1,y2-y1)
-                if L>Lbest: Lbest=L; best=(y1,y2)
-        if best is not None: return (best[0]+best[1])/2.0
-    return float(np.argmin(blur.mean(axis=1)))
-
-def detect_dashes_tight(gray, x_center_frac, x_half_frac, y_top_frac, y_bot_frac):
+        # longest segment with |slope| < 0.08 (vertical ones have dx == 0 and drop out)
+        S=lines.reshape(-1,4).astype(np.float64)
+        dx=S[:,2]-S[:,0]; dy=S[:,3]-S[:,1]
+        ok=(dx!=0) & (np.abs(dy) < 0.08*np.abs(dx))
+        if ok.any():
+            L=np.where(ok, np.hypot(dx,dy), -1.0); i=int(np.argmax(L))
+            return (S[i,1]+S[i,3])/2.0
+    # fallback: darkest row (cv2's vectorized row reduce, not NumPy's generic mean)
+    return float(np.argmin(cv2.reduce(blur, 1, cv2.REDUCE_AVG, dtype=cv2.CV_32F)))
+
+def detect_dashes_tight(gray, x_center_frac, x_half_frac, y_top_frac, y_bot_frac, M=None):
     H,W=gray.shape
     x0=max(0,int((x_center_frac-x_half_frac)*W)); x1=min(W,int((x_center_frac+x_half_frac)*W))
     y0=max(0,int(y_top_frac*H)); y1=min(H,int(y_bot_frac*H))
-    roi=gray[y0:y1, x0:x1]
-    bw=otsu(roi, invert=True)
+    roi=crop_rotated(gray, x0, y0, x1, y1, M)
+    # ink = anything 20 levels darker than the ROI's mean (printed dashes on paper);
+    # one mean + one threshold pass instead of Otsu's histogram search
+    _, bw=cv2.threshold(roi, cv2.mean(roi)[0]-20, 255, cv2.THRESH_BINARY_INV)
     bw=cv2.morphologyEx(bw, cv2.MORPH_OPEN, np.ones((3,3),np.uint8), iterations=1)
-    cnts,_=cv2.findContours(bw, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-    cand=[]
+    # one C pass for all blobs' bounding boxes (row 0 is the background)
+    _,_,stats,_=cv2.connectedComponentsWithStats(bw, connectivity=8, ltype=cv2.CV_32S)
+    x,y,w,h=(stats[1:,k].astype(np.float64) for k in range(4))
     areaR=roi.shape[0]*roi.shape[1]
-    for c in cnts:
-        x,y,w,h=cv2.boundingRect(c)
-        area=w*h
-        if area < 0.001*areaR: continue
-        ar=w/float(h) if h else 0
-        if 0.4<=ar<=2.5:
-            cx=x+w/2.0; cy=y+h/2.0
-            cand.append((cy,(cx,cy)))
-    if not cand:
+    ar=w/np.maximum(h,1)
+    keep=(w*h >= 0.001*areaR) & (ar >= 0.4) & (ar <= 2.5)
+    if not keep.any():
         # fallback to ROI extremes
         top=(x0+0.5*(x1-x0), y0+0.05*(y1-y0))
         bot=(x0+0.5*(x1-x0), y0+0.95*(y1-y0))
         return (float(top[0]),float(top[1])), (float(bot[0]),float(bot[1]))
-    cand.sort(key=lambda t:t[0])
-    top=(cand[0][1][0]+x0, cand[0][1][1]+y0)
-    bot=(cand[-1][1][0]+x0, cand[-1][1][1]+y0)
+    cx=(x+w/2.0)[keep]; cy=(y+h/2.0)[keep]
+    it, ib = int(np.argmin(cy)), int(np.argmax(cy))
+    top=(cx[it]+x0, cy[it]+y0)
+    bot=(cx[ib]+x0, cy[ib]+y0)
     # enforce roughly same x
     mx=(top[0]+bot[0])/2.0
     top=(mx, top[1]); bot=(mx, bot[1])
     return (float(top[0]),float(top[1])), (float(bot[0]),float(bot[1]))
 
-def detect_line_at_right(gray, y_center_frac, band_half_frac, min_len_frac=0.55):
+def detect_line_at_right(gray, y_center_frac, band_half_frac, min_len_frac=0.55, M=None):
     H,W=gray.shape
     y0=int(max(0,(y_center_frac-band_half_frac)*H))
     y1=int(min(H,(y_center_frac+band_half_frac)*H))
-    band=gray[y0:y1,:]
+    band=crop_rotated(gray, 0, y0, W, y1, M)
     y_in=avg_y_of_longest_horizontal(band, min_len_px=min_len_frac*W, strict=True)
     y=y0+y_in; xr=float(W-10)
     return (xr, float(y))
@@ -204,17 +295,22 @@ def norm_fids(f: FourFids, W, H) -> FourFidsNorm:
         (f.thin_line_right[0]/W, f.thin_line_right[1]/H),
     )
 
-def detect_four_on_image(gray, tpl_norm: FourFidsNorm, tight=0.05):
+def detect_four_on_image(gray, tpl_norm: FourFidsNorm, tight=0.05, M=None):
+    """Find the four fiducials in the page as rotated by M (None = as is); only
+    the search ROIs are resampled, never the whole page."""
     H,W=gray.shape
-    # dashes
-    x_center=tpl_norm.top_dash[0]; x_hw=max(0.02, tight)
-    y_top= max(0.02, tpl_norm.top_dash[1]-0.12)
-    y_bot= min(0.98, tpl_norm.bottom_dash[1]+0.12)
-    top_dash, bottom_dash = detect_dashes_tight(gray, x_center, x_hw, y_top, y_bot)
+    # dashes: one short window around each end of the template's dash column (not the
+    # whole column); topmost blob of the upper window, bottommost of the lower one
+    x_center=tpl_norm.top_dash[0]; x_hw=max(0.02, tight); y_hw=max(0.12, tight)
+    ty, by = tpl_norm.top_dash[1], tpl_norm.bottom_dash[1]
+    top_dash, _ = detect_dashes_tight(gray, x_center, x_hw, max(0.02, ty-y_hw), ty+y_hw, M)
+    _, bottom_dash = detect_dashes_tight(gray, x_center, x_hw, by-y_hw, min(0.98, by+y_hw), M)
+    mx = (top_dash[0]+bottom_dash[0])/2.0
+    top_dash, bottom_dash = (mx, top_dash[1]), (mx, bottom_dash[1])
     # lines
     band_hw=max(0.015, tight)
-    top_line_right  = detect_line_at_right(gray, tpl_norm.top_line_right[1],  band_hw, min_len_frac=0.60)
-    thin_line_right = detect_line_at_right(gray, tpl_norm.thin_line_right[1], band_hw, min_len_frac=0.55)
+    top_line_right  = detect_line_at_right(gray, tpl_norm.top_line_right[1],  band_hw, min_len_frac=0.60, M=M)
+    thin_line_right = detect_line_at_right(gray, tpl_norm.thin_line_right[1], band_hw, min_len_frac=0.55, M=M)
     # enforce ordering
     if top_line_right[1] > thin_line_right[1]:
         top_line_right, thin_line_right = thin_line_right, top_line_right
@@ -235,9 +331,7 @@ def H_is_reasonable(H, W, Ht):
     left_x=(warped[0,0]+warped[2,0])/2.0; right_x=(warped[1,0]+warped[3,0])/2.0
     if not (top_y < bot_y and left_x < right_x): return False
     # side balance
-    def dist(a,b): return np.hypot(*(a-b))
-    w1=dist(warped[0],warped[1]); w2=dist(warped[2],warped[3])
-    h1=dist(warped[0],warped[2]); h2=dist(warped[1],warped[3])
+    w1, w2, h1, h2 = _side_lengths(warped)
     if max(w1,w2)/max(1.0,min(w1,w2)) > 2.2: return False
     if max(h1,h2)/max(1.0,min(h1,h2)) > 2.2: return False
     return True
@@ -251,27 +345,120 @@ def getSimilarity(src: FourFids, dst: FourFids):
     # Use two lines: vector between dashes gives scale on Y; top_line gives Y offset; dash x gives X offset.
     sY = (dst.bottom_dash[1]-dst.top_dash[1]) / max(1e-6, (src.bottom_dash[1]-src.top_dash[1]))
     sX = sY
-    R = np.eye(2, dtype=np.float32)
-    T = np.array([dst.top_dash[0]-sX*src.top_dash[0], dst.top_dash[1]-sY*src.top_dash[1]], dtype=np.float32)
-    M = np.hstack([R*np.array([[sX],[sY]], dtype=np.float32), T.reshape(2,1)])
-    return M  # affine 2x3
+    return np.array([[sX, 0, dst.top_dash[0]-sX*src.top_dash[0]],
+                     [0, sY, dst.top_dash[1]-sY*src.top_dash[1]]], np.float32)  # affine 2x3
 
 # ---------- drawing ----------
-def draw_bullseye(img, center, radius=16):
-    x,y=int(center[0]),int(center[1])
-    for col,r in [((0,0,0),radius),((255,255,255),int(radius*0.55)),((0,0,0),int(radius*0.25))]:
-        cv2.circle(img,(x,y),r,col,-1,cv2.LINE_AA)
-    cv2.circle(img,(x,y),max(1,radius//10),(255,255,255),-1,cv2.LINE_AA)
-
-def add_corner_bullseyes(img, margin=22, radius=16):
-    H,W=img.shape[:2]
-    for pt in [(margin,margin),(W-margin,margin),(margin,H-margin),(W-margin,H-margin)]:
-        draw_bullseye(img, pt, radius)
-
 def draw_points(img, f: FourFids, color=(0,0,255)):
     for pt in [f.top_dash,f.bottom_dash,f.top_line_right,f.thin_line_right]:
         cv2.drawMarker(img,(int(pt[0]),int(pt[1])),color,cv2.MARKER_CROSS,18,2)
 
+# ---------- template (cached) ----------
+def load_template(path):
+    """Read and deskew the template -> gray, or None. Only gray is ever needed
+    (fiducials come from it); deskewing should be minimal, but makes normalized positions stable."""
+    tgray = read_gray(Path(path))
+    if tgray is None: return None
+    tangle, tM = coarse_deskew_by_header(tgray)
+    return apply_rotation(tgray, tM) if abs(tangle) > 0.1 else tgray
+
+def detect_template_fids(gray):
+    """Detect the template's fiducials broadly (generous bands)."""
+    top_line_right  = detect_line_at_right(gray, 0.10, 0.10, min_len_frac=0.60)
+    thin_line_right = detect_line_at_right(gray, 0.24, 0.08, min_len_frac=0.55)
+    # dashes: left 14% ± 5%
+    top_dash, bottom_dash = detect_dashes_tight(gray, 0.14, 0.05, 0.02, 0.98)
+    # enforce order
+    if top_line_right[1] > thin_line_right[1]:
+        top_line_right, thin_line_right = thin_line_right, top_line_right
+    return FourFids(top_dash, bottom_dash, top_line_right, thin_line_right)
+
+def load_or_build_template_fids(templ_path: str, cache_dir: str):
+    """Return (template FourFids, Wt, Ht). Cached as one small .npz per template
+    version, so a repeat run neither decodes, deskews nor measures the template."""
+    cache = Path(cache_dir); cache.mkdir(parents=True, exist_ok=True)
+    cache_path = cache / f"fids4_{templ_fingerprint(templ_path)}.npz"
+    z = load_npz(cache_path, ("shape", "fids"))  # None: missing or bad, rebuild below
+    if z is not None:
+        Ht, Wt = (int(v) for v in z["shape"])
+        return FourFids(*(tuple(pt) for pt in z["fids"].tolist())), Wt, Ht
+    tgray = load_template(templ_path)
+    if tgray is None:
+        raise RuntimeError(f"Cannot read template: {templ_path}")
+    templ_f = detect_template_fids(tgray); Ht, Wt = tgray.shape[:2]
+    save_npz(cache_path, shape=np.array([Ht, Wt]),
+             fids=np.array([templ_f.top_dash, templ_f.bottom_dash,
+                            templ_f.top_line_right, templ_f.thin_line_right], np.float64))
+    return templ_f, Wt, Ht
+
+# ---------- per-file worker ----------
+# template fiducials and options, set once per worker process (see _batch.imap_pool)
+_templ_f = _templ_norm = _args = _out_dir = None
+_Ht = _Wt = 0
+
+def _set_state(templ_f, templ_norm, Ht, Wt, args, out_dir):
+    global _templ_f, _templ_norm, _Ht, _Wt, _args, _out_dir
+    _templ_f, _templ_norm, _Ht, _Wt, _args, _out_dir = templ_f, templ_norm, Ht, Wt, args, out_dir
+
+def _init_worker(*state):
+    _set_state(*state)
+    init_cv_worker(opencl=_args.opencl)
+
+def _emit(recs):
+    for lvl, m in recs: LOG[lvl](m)
+
+def _process_one(job):
+    """Deskew, detect, warp and save one page; returns [(level, message), ...]."""
+    i, total, p = job
+    args, out_dir, templ_f, Wt, Ht = _args, _out_dir, _templ_f, _Wt, _Ht
+    prefix=f"[file {i}/{total}]"
+    recs=[]
+    img, g = read_bgr_gray(p)
+    if img is None:
+        return [("warn", f"{prefix} skip: cannot read {p.name}")]
+
+    # 1) coarse deskew: nothing is rotated yet; the color page is warped once, in step 3
+    angle, Mrot = coarse_deskew_by_header(g)
+    rotated = abs(angle) > 0.1
+
+    # 2) anchored detection (in deskewed coordinates; only the search ROIs are rotated)
+    fids = detect_four_on_image(g, _templ_norm, tight=args.tight, M=Mrot if rotated else None)
+
+    # 3) homography → checks → fallbacks, each composed with the deskew rotation
+    #    into a single warp of the original page (--opencl: on the device, via a UMat)
+    R = to3x3(Mrot) if rotated else np.eye(3)
+    src = cv2.UMat(img) if args.opencl else img
+    Hproj = getH(fids, templ_f)
+    if not H_is_reasonable(Hproj, img.shape[1], img.shape[0]):
+        recs.append(("warn", f"{prefix} homography unstable; trying affine."))
+        A = getA(fids, templ_f)
+        warped = _host(cv2.warpAffine(src, (to3x3(A) @ R)[:2], (Wt, Ht), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE))
+        mode="affine"
+    else:
+        warped = _host(cv2.warpPerspective(src, Hproj @ R, (Wt, Ht),
+                                           flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE))
+        mode="homography"
+
+    # if still looks tiny/tilted (extreme), try similarity as last resort
+    if min(warped.shape[:2]) < min(Ht,Wt)*0.3:
+        recs.append(("warn", f"{prefix} warp looks bad; using similarity fallback."))
+        S = getSimilarity(fids, templ_f)
+        warped = _host(cv2.warpAffine(src, (to3x3(S) @ R)[:2], (Wt, Ht), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE))
+        mode="similarity"
+
+    # 4) bullseyes + save final
+    add_bullseyes(warped, margin=args.bull_margin, radius=args.bull_radius)
+    out_final = out_dir / f"{p.stem}_final.jpg"
+    imwrite_jpeg(out_final, warped, args.jpeg_quality)
+
+    if args.write_debug:
+        sd = apply_rotation(img, Mrot) if rotated else img.copy()
+        draw_points(sd, fids, (0,0,255))
+        imwrite_jpeg(out_dir / f"{p.stem}_debug.jpg", sd, args.jpeg_quality)
+
+    recs.append(("ok", f"{prefix} {p.name} → {out_final.name} ({mode})"))
+    return recs
+
 # ---------- main ----------
 def main():
     ap=argparse.ArgumentParser("Robust OMR alignment with deskew + anchored search + safe fallbacks")
@@ -288,8 +475,21 @@ def main():
                 help="Keep *_debug.jpg (do not delete after processing)")
     ap.add_argument("--allow-homography", action="store_true",
                 help="Try homography; otherwise always use affine (default).")
+    ap.add_argument("--cache-dir", default=".template_cache",
+                help="Folder to cache the template's detected fiducials.")
+    ap.add_argument("--jpeg-quality", type=int, default=85,
+                help="JPEG quality (1-100) for written pages; lower is smaller and faster to encode")
+    ap.add_argument("--opencl", action="store_true",
+                help="Warp pages on an OpenCL device (OpenCV T-API) when one is available")
+    ap.add_argument("--workers", type=int, default=max(1, (os.cpu_count() or 2)-1),
+                help="Worker processes (default: CPU count - 1; 1 = serial)")
     args=ap.parse_args()
 
+    if args.opencl:
+        cv2.ocl.setUseOpenCL(True)
+        if not cv2.ocl.useOpenCL():
+            log_warn("--opencl: no usable OpenCL device, warping on the CPU"); args.opencl = False
+
     in_dir, out_dir = Path(args.input), Path(args.output)
     out_dir.mkdir(parents=True, exist_ok=True)
     if args.clean_before:
@@ -303,108 +503,32 @@ def main():
     if not files:
         log_err(f"No images with extensions {exts} in {in_dir}"); sys.exit(1)
 
-    templ=cv2.imread(str(args.template))
-    if templ is None:
-        log_err(f"Cannot read template: {args.template}"); sys.exit(1)
-
-    # Deskew the template (should be minimal, but makes normalized positions stable)
-    tgray=to_gray(templ)
-    tgray_rot, tangle, _ = coarse_deskew_by_header(tgray)
-    if abs(tangle) > 0.1:
-        templ = cv2.cvtColor(tgray_rot, cv2.COLOR_GRAY2BGR)
-    Ht,Wt = templ.shape[:2]
-
-    # Detect template fiducials broadly, then normalize
-    def detect_template_fids(gray):
-        # generous bands
-        top_line_right  = detect_line_at_right(gray, 0.10, 0.10, min_len_frac=0.60)
-        thin_line_right = detect_line_at_right(gray, 0.24, 0.08, min_len_frac=0.55)
-        # dashes: left 14% ± 5%
-        top_dash, bottom_dash = detect_dashes_tight(gray, 0.14, 0.05, 0.02, 0.98)
-        # enforce order
-        if top_line_right[1] > thin_line_right[1]:
-            top_line_right, thin_line_right = thin_line_right, top_line_right
-        return FourFids(top_dash, bottom_dash, top_line_right, thin_line_right)
-
-    templ_f = detect_template_fids(to_gray(templ))
+    # Template fiducials: detected ONCE per template version (cached), then normalized
+    try:
+        templ_f, Wt, Ht = load_or_build_template_fids(args.template, args.cache_dir)
+    except RuntimeError as e:
+        log_err(str(e)); sys.exit(1)
     templ_norm = norm_fids(templ_f, Wt, Ht)
 
     if args.write_debug:
-        td = templ.copy(); draw_points(td, templ_f, (255,0,0))
-        cv2.imwrite(str(out_dir / "_template_debug.jpg"), td)
-
-    total=len(files); log_info(f"Found {total} file(s). Output → {out_dir.resolve()}")
-
-    for i,p in enumerate(files, start=1):
-        prefix=f"[file {i}/{total}]"
-        img=cv2.imread(str(p))
-        if img is None:
-            log_warn(f"{prefix} skip: cannot read {p.name}")
-            continue
-
-        # 1) coarse deskew
-        g=to_gray(img)
-        g_rot, angle, M = coarse_deskew_by_header(g)
-        if abs(angle)>0.1:
-            img_rot=cv2.warpAffine(img, M, (img.shape[1], img.shape[0]),
-                                   flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-        else:
-            img_rot=img.copy()
-            g_rot=g
-
-        # 2) anchored detection (on deskewed image)
-        fids = detect_four_on_image(to_gray(img_rot), templ_norm, tight=args.tight)
-
-        # 3) homography → checks → fallbacks
-        Hproj = getH(fids, templ_f)
-        if not H_is_reasonable(Hproj, img_rot.shape[1], img_rot.shape[0]):
-            log_warn(f"{prefix} homography unstable; trying affine.")
-            A = getA(fids, templ_f)
-            warped = cv2.warpAffine(img_rot, A, (Wt, Ht), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-            mode="affine"
-        else:
-            warped = cv2.warpPerspective(img_rot, Hproj, (Wt, Ht),
-                                         flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-            mode="homography"
-
-        # if still looks tiny/tilted (extreme), try similarity as last resort
-        if min(warped.shape[:2]) < min(Ht,Wt)*0.3:
-            log_warn(f"{prefix} warp looks bad; using similarity fallback.")
-            S = getSimilarity(fids, templ_f)
-            warped = cv2.warpAffine(img_rot, S, (Wt, Ht), flags=cv2.INTER_LINEAR, borderMode=cv2.BORDER_REPLICATE)
-            mode="similarity"
-
-        # 4) bullseyes + save final
-        add_corner_bullseyes(warped, margin=args.bull_margin, radius=args.bull_radius)
-        out_final = out_dir / f"{p.stem}_final.jpg"
-        cv2.imwrite(str(out_final), warped)
-
-        if args.write_debug:
-            sd = img_rot.copy(); draw_points(sd, fids, (0,0,255))
-            cv2.imwrite(str(out_dir / f"{p.stem}_debug.jpg"), sd)
-
-        # keep only final (unless --keep-debug)
-        for q in out_dir.glob(f"{p.stem}_*.*"):
-            if q.name == out_final.name:
-                continue
-            if args.keep_debug and q.name.endswith("_debug.jpg"):
-                continue
-            try:
-                q.unlink()
-            except Exception:
-                pass
-
-        log_ok(f"{prefix} {p.name} → {out_final.name} ({mode})")
-
-    # global cleanup
-    for q in out_dir.glob("*"):
-        if q.suffix.lower() == ".jpg" and not q.name.endswith("_final.jpg"):
-            if args.keep_debug and q.name.endswith("_debug.jpg"):
-                continue
-            try:
-                q.unlink()
-            except Exception:
-                pass
+        td = cv2.cvtColor(load_template(args.template), cv2.COLOR_GRAY2BGR); draw_points(td, templ_f, (255,0,0))
+        imwrite_jpeg(out_dir / "_template_debug.jpg", td, args.jpeg_quality)
+
+    total=len(files)
+    workers=max(1, min(args.workers, total))
+    log_info(f"Found {total} file(s). Output → {out_dir.resolve()} ({workers} worker(s))")
+
+    state=(templ_f, templ_norm, Ht, Wt, args, out_dir)
+    jobs=[(i, total, p) for i,p in enumerate(files, start=1)]
+    if workers > 1:
+        for recs in imap_pool(_process_one, jobs, workers, _init_worker, state):
+            _emit(recs)
+    else:
+        _set_state(*state)
+        for job in jobs:
+            _emit(_process_one(job))
+
+    clean_outputs(out_dir, (p.stem for p in files), keep_debug=args.keep_debug)
     log_info("All done. Only *_final.jpg kept.")
 if __name__=="__main__":
     main()